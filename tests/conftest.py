@@ -0,0 +1,10 @@
+import pytest
+
+def _logged(mock_method):
+    """Snapshot the calls made to a mocked logger method as a set of (args, kwargs) tuples"""
+    return {(c.args, tuple(sorted(c.kwargs.items()))) for c in mock_method.call_args_list}
+
+@pytest.fixture
+def logged():
+    """Fixture to look up logged messages by set membership instead of assert_any_call scans"""
+    return _logged
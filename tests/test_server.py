@@ -1,221 +1,466 @@
+import asyncio
 import os
-import subprocess
-import pytest
-from unittest.mock import patch, MagicMock
+import shutil
 import sys
-
-# Add parent directory to path to import the server module
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-import unix_manual_server
-
-@pytest.fixture
-def mock_subprocess_run():
-    """Fixture to mock subprocess.run"""
-    with patch('subprocess.run') as mock_run:
-        yield mock_run
-
-@pytest.fixture
-def mock_os_path_exists():
+import pytest
+from types import SimpleNamespace as NS
+from unittest.mock import patch, AsyncMock, MagicMock
+
+# The server tools are coroutines; run them on asyncio via the anyio plugin
+pytestmark = pytest.mark.anyio
+
+# Canned subprocess results for tests that only read stdout/returncode
+OK = NS(stdout="output", returncode=0, stderr="")
+NOT_FOUND = NS(stdout="", returncode=1, stderr="")
+LS_PATH = NS(stdout="/usr/bin/ls\n", returncode=0, stderr="")
+NOT_HELP = NS(stdout="Some output that doesn't look like help", returncode=0, stderr="")
+MAN_PATH = NS(stdout="/usr/share/man/man1/ls.1.gz\n", returncode=0, stderr="")
+MAN_PAGE = NS(stdout="FORMATTED MAN PAGE", returncode=0, stderr="")
+NO_MAN_PAGE = NS(stdout="", returncode=16, stderr="No manual entry")
+# End-of-answer marker echoed by the lookup shell
+END = "__UNIX_MANUAL_END__"
+USAGE = NS(stdout="Usage: command\nOptions available", returncode=0, stderr="")
+
+@pytest.fixture(scope="session", autouse=True)
+def ums():
+    """Fixture to import the server module once per session"""
+    # Add parent directory to path to import the server module
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import unix_manual_server
+    return unix_manual_server
+
+@pytest.fixture(scope="module", autouse=True)
+def _patched_exec():
+    """Patch asyncio.create_subprocess_exec once for the whole module"""
+    p = patch.object(asyncio, "create_subprocess_exec")
+    m = p.start()
+    yield m
+    p.stop()
+
+@pytest.fixture(scope="module", autouse=True)
+def _patched_which():
+    """Patch shutil.which once for the whole module"""
+    p = patch.object(shutil, "which")
+    m = p.start()
+    yield m
+    p.stop()
+
+@pytest.fixture(scope="module", autouse=True)
+def _patched_os(ums):
+    """Patch the os helpers used by list_common_commands once for the whole module"""
+    patchers = {
+        "exists": patch.object(os.path, "exists"),
+        "isdir": patch.object(os.path, "isdir"),
+        "access": patch.object(os, "access"),
+        "scandir": patch.object(os, "scandir"),
+    }
+    mocks = {name: p.start() for name, p in patchers.items()}
+    yield mocks
+    for p in patchers.values():
+        p.stop()
+
+@pytest.fixture(scope="module", autouse=True)
+def _patched_logger(ums):
+    """Patch the server logger once for the whole module"""
+    p = patch.object(ums, "logger")
+    m = p.start()
+    yield m
+    p.stop()
+
+@pytest.fixture(autouse=True)
+def _clear_caches(ums):
+    """Start every test with empty server caches"""
+    ums._PATH_CACHE.clear()
+    ums._DOC_CACHE.clear()
+    ums._EXISTS_CACHE.clear()
+    ums._COMMON_CACHE.clear()
+    ums._MAN_CACHE.clear()
+    # Each test runs on its own event loop, so it also needs its own lookup shell
+    ums._shell_proc = None
+    ums._shell_lock = asyncio.Lock()
+
+async def _hang(*args):
+    """Never finish, like a command that ignores its input"""
+    await asyncio.Event().wait()
+
+def _stream(data):
+    """Build a finished stream holding data, like a child's closed stdout"""
+    stream = asyncio.StreamReader()
+    stream.feed_data(data)
+    stream.feed_eof()
+    return stream
+
+def _fake_proc(result=None, read=None):
+    """Build a fake asyncio process that produces the given canned result"""
+    result = result or NS(stdout="", returncode=0, stderr="")
+    proc = MagicMock(returncode=result.returncode)
+    proc.stdout = _stream(result.stdout.encode())
+    proc.stderr = _stream(result.stderr.encode())
+    if read is not None:
+        proc.stdout = MagicMock(read=AsyncMock(side_effect=read))
+    proc.wait = AsyncMock(return_value=result.returncode)
+    return proc
+
+def _fake_shell(*answers, banner=""):
+    """Build a fake lookup shell that prints banner on startup and replies to each query with the next answer"""
+    proc = MagicMock(returncode=None)
+    proc.stdin.drain = AsyncMock()
+    # The startup handshake is `echo; echo END`, so its reply is the banner and an extra newline
+    proc.stdout = _stream("".join(f"{answer}{END}\n" for answer in (banner + "\n", *answers)).encode())
+    proc.wait = AsyncMock(return_value=-9)
+    return proc
+
+def _scandir(names, is_file=True):
+    """Build a fake os.scandir context manager yielding entries for names"""
+    def scandir(directory):
+        it = MagicMock()
+        it.__enter__.return_value = iter([
+            NS(name=name, path=os.path.join(directory, name), is_file=lambda follow_symlinks=True: is_file)
+            for name in names
+        ])
+        return it
+    return scandir
+
+def _reset(m, return_value=None):
+    """Reset a module-scoped mock for the next test"""
+    m.reset_mock()
+    m.side_effect = None
+    m.return_value = return_value
+    return m
+
+@pytest.fixture(autouse=True)
+def mock_exec(_patched_exec):
+    """Fixture to mock asyncio.create_subprocess_exec"""
+    return _reset(_patched_exec)
+
+@pytest.fixture(autouse=True)
+def mock_which(_patched_which):
+    """Fixture to mock shutil.which, defaulting to a PATH miss"""
+    return _reset(_patched_which)
+
+@pytest.fixture(autouse=True)
+def mock_os_path_exists(_patched_os):
     """Fixture to mock os.path.exists"""
-    with patch('os.path.exists') as mock_exists:
-        mock_exists.return_value = True
-        yield mock_exists
+    return _reset(_patched_os["exists"], True)
 
-@pytest.fixture
-def mock_os_path_isdir():
+@pytest.fixture(autouse=True)
+def mock_os_path_isdir(_patched_os):
     """Fixture to mock os.path.isdir"""
-    with patch('os.path.isdir') as mock_isdir:
-        mock_isdir.return_value = True
-        yield mock_isdir
-
-@pytest.fixture
-def mock_os_path_isfile():
-    """Fixture to mock os.path.isfile"""
-    with patch('os.path.isfile') as mock_isfile:
-        mock_isfile.return_value = True
-        yield mock_isfile
-
-@pytest.fixture
-def mock_os_access():
+    return _reset(_patched_os["isdir"], True)
+
+@pytest.fixture(autouse=True)
+def mock_os_access(_patched_os):
     """Fixture to mock os.access"""
-    with patch('os.access') as mock_access:
-        mock_access.return_value = True
-        yield mock_access
-
-@pytest.fixture
-def mock_os_listdir():
-    """Fixture to mock os.listdir"""
-    with patch('os.listdir') as mock_listdir:
-        mock_listdir.return_value = ['ls', 'cat', 'grep']
-        yield mock_listdir
-
-@pytest.fixture
-def mock_logger():
+    return _reset(_patched_os["access"], True)
+
+@pytest.fixture(autouse=True)
+def mock_os_scandir(_patched_os):
+    """Fixture to mock os.scandir"""
+    m = _reset(_patched_os["scandir"])
+    m.side_effect = _scandir(['ls', 'cat', 'grep'])
+    return m
+
+@pytest.fixture(autouse=True)
+def mock_logger(_patched_logger):
     """Fixture to mock the logger"""
-    with patch('unix_manual_server.logger') as mock_logger:
-        yield mock_logger
+    return _reset(_patched_logger)
 
-def test_get_command_path_success(mock_subprocess_run, mock_logger):
+async def test_get_command_path_success(ums, mock_exec, mock_logger, logged):
     """Test get_command_path when command is found"""
     # Configure the mock to return a valid path
-    process_mock = MagicMock()
-    process_mock.stdout = "/usr/bin/ls\n"
-    process_mock.returncode = 0
-    mock_subprocess_run.return_value = process_mock
+    shell = _fake_shell(LS_PATH.stdout)
+    mock_exec.return_value = shell
+
+    with patch.dict(os.environ, {"SHELL": "/bin/sh"}):
+        result = await ums.get_command_path("ls")
+
+    assert result == "/usr/bin/ls"
+    # A login shell, so the PATH from the profile files is searched too
+    assert mock_exec.call_args.args == ("/bin/sh", "-l")
+    assert shell.stdin.write.call_args_list == [
+        ((f"echo; echo {END}\n".encode(),),),
+        ((f"command -v ls 2>/dev/null; echo {END}\n".encode(),),),
+    ]
+    calls = logged(mock_logger.debug)
+    assert (("Searching for command path: ls",), ()) in calls
+    assert (("Found command path: /usr/bin/ls",), ()) in calls
+
+async def test_get_command_path_which(ums, mock_which, mock_exec):
+    """Test get_command_path skips the shell when the command is on PATH"""
+    mock_which.return_value = "/usr/bin/ls"
 
-    result = unix_manual_server.get_command_path("ls")
+    result = await ums.get_command_path("ls")
 
     assert result == "/usr/bin/ls"
-    mock_subprocess_run.assert_called_once()
-    mock_logger.debug.assert_any_call("Searching for command path: ls")
-    mock_logger.debug.assert_any_call("Found command path: /usr/bin/ls")
+    mock_which.assert_called_once_with("ls")
+    mock_exec.assert_not_called()
+
+async def test_get_command_path_cached(ums, mock_exec):
+    """Test get_command_path only asks the shell on the first lookup"""
+    shell = _fake_shell(LS_PATH.stdout)
+    mock_exec.return_value = shell
+
+    assert await ums.get_command_path("ls") == "/usr/bin/ls"
+    assert await ums.get_command_path("ls") == "/usr/bin/ls"
+
+    # The startup handshake and a single query
+    assert shell.stdin.write.call_count == 2
+
+@pytest.mark.parametrize("banner", ["/etc/motd is outdated\n", "Welcome"])
+async def test_get_command_path_skips_profile_output(ums, mock_exec, banner):
+    """Test output printed by the profile files, with or without a final newline, isn't mistaken for an answer"""
+    mock_exec.return_value = _fake_shell("/usr/local/bin/brew\n", banner=banner)
+
+    assert await ums.get_command_path("brew") == "/usr/local/bin/brew"
+
+async def test_get_command_path_cache_expires(ums, mock_which):
+    """Test cache hits don't refresh a path's timestamp, so it still expires"""
+    mock_which.return_value = "/usr/bin/ls"
+    with patch('time.monotonic', return_value=100.0):
+        await ums.get_command_path("ls")
+    with patch('time.monotonic', return_value=100.0 + ums._CACHE_TTL - 1):
+        await ums.get_command_path("ls")
+    mock_which.assert_called_once()
+
+    with patch('time.monotonic', return_value=100.0 + ums._CACHE_TTL):
+        await ums.get_command_path("ls")
+    assert mock_which.call_count == 2
 
-def test_get_command_path_not_found(mock_subprocess_run, mock_logger):
+async def test_get_command_path_reuses_shell(ums, mock_exec):
+    """Test concurrent lookups are answered in turn by a single shell"""
+    mock_exec.return_value = _fake_shell("/usr/bin/ls\n", "/usr/bin/cat\n")
+
+    results = await asyncio.gather(ums.get_command_path("ls"), ums.get_command_path("cat"))
+
+    assert results == ["/usr/bin/ls", "/usr/bin/cat"]
+    mock_exec.assert_called_once()
+
+async def test_get_command_path_not_found(ums, mock_exec, mock_logger):
     """Test get_command_path when command is not found"""
     # Configure the mock to return empty output
-    process_mock = MagicMock()
-    process_mock.stdout = "\n"
-    process_mock.returncode = 1
-    mock_subprocess_run.return_value = process_mock
+    mock_exec.return_value = _fake_shell("")
 
-    result = unix_manual_server.get_command_path("nonexistent-command")
+    result = await ums.get_command_path("nonexistent-command")
 
     assert result is None
-    mock_subprocess_run.assert_called_once()
+    mock_exec.assert_called_once()
     mock_logger.warning.assert_called_with("Command not found: nonexistent-command")
 
-def test_get_command_path_exception(mock_subprocess_run, mock_logger):
-    """Test get_command_path when subprocess raises exception"""
+async def test_get_command_path_exception(ums, mock_exec, mock_logger):
+    """Test get_command_path when the shell cannot be started"""
     # Configure the mock to raise an exception
-    mock_subprocess_run.side_effect = subprocess.SubprocessError("Test error")
+    mock_exec.side_effect = OSError("Test error")
 
-    result = unix_manual_server.get_command_path("ls")
+    result = await ums.get_command_path("ls")
 
     assert result is None
-    mock_subprocess_run.assert_called_once()
+    mock_exec.assert_called_once()
     mock_logger.error.assert_called_once()
 
-def test_safe_execute_success(mock_subprocess_run, mock_logger):
-    """Test safe_execute when command succeeds"""
-    # Configure the mock to return successful execution
-    process_mock = MagicMock()
-    process_mock.stdout = "Success output"
-    process_mock.returncode = 0
-    mock_subprocess_run.return_value = process_mock
-
-    result = unix_manual_server.safe_execute(["ls", "-l"])
-
-    assert result == process_mock
-    mock_subprocess_run.assert_called_once_with(
-        ["ls", "-l"],
-        capture_output=True,
-        text=True,
-        timeout=10,
-        shell=False
-    )
-    mock_logger.debug.assert_any_call("Executing command: ['ls', '-l'] with timeout=10")
-    mock_logger.debug.assert_any_call("Command exit code: 0")
-    mock_logger.debug.assert_any_call("Command stdout first 100 chars: Success output")
+async def test_shell_lookup_replaces_stuck_shell(ums, mock_exec, mock_logger):
+    """Test a shell that stops answering is killed and replaced on the next lookup"""
+    handshake = iter([b"\n", f"{END}\n".encode()])
 
-def test_safe_execute_timeout(mock_subprocess_run, mock_logger):
-    """Test safe_execute when command times out"""
-    # Configure the mock to raise TimeoutExpired
-    mock_subprocess_run.side_effect = subprocess.TimeoutExpired(cmd="ls", timeout=10)
+    async def readline():
+        # Get through startup, then never answer the query
+        return next(handshake, None) or await _hang()
 
-    result = unix_manual_server.safe_execute(["ls", "-l"])
+    stuck = _fake_shell()
+    stuck.stdout = MagicMock(readline=readline)
+    mock_exec.side_effect = [stuck, _fake_shell(LS_PATH.stdout)]
 
-    assert result is None
-    mock_subprocess_run.assert_called_once()
+    assert await ums.shell_lookup("ls", timeout=0.01) is None
+    stuck.kill.assert_called_once()
     mock_logger.warning.assert_called_once()
 
-def test_safe_execute_error(mock_subprocess_run, mock_logger):
-    """Test safe_execute when command raises error"""
-    # Configure the mock to raise SubprocessError
-    mock_subprocess_run.side_effect = subprocess.SubprocessError("Test error")
+    assert await ums.shell_lookup("ls") == "/usr/bin/ls"
+    assert mock_exec.call_count == 2
 
-    result = unix_manual_server.safe_execute(["ls", "-l"])
+async def test_shell_lookup_slow_startup(ums, mock_exec):
+    """Test a slow login profile gets the startup timeout rather than the per-query one"""
+    shell = _fake_shell(LS_PATH.stdout)
+    stream = shell.stdout
+    profile_delay = [0.1]
 
-    assert result is None
-    mock_subprocess_run.assert_called_once()
-    mock_logger.error.assert_called_once()
+    async def slow_readline():
+        # Only the first line, i.e. the profile files, is slow
+        if profile_delay:
+            await asyncio.sleep(profile_delay.pop())
+        return await stream.readline()
 
-def test_search_help_documentation_with_h(mock_logger):
-    """Test search_help_documentation with -h option"""
-    with patch('unix_manual_server.safe_execute') as mock_safe_execute:
-        # First call (--help) returns output that doesn't match help pattern
-        help_mock1 = MagicMock()
-        help_mock1.returncode = 0
-        help_mock1.stdout = "Some output that doesn't look like help"
+    shell.stdout = MagicMock(readline=slow_readline)
+    mock_exec.return_value = shell
 
-        # Second call (-h) returns valid help that matches pattern
-        help_mock2 = MagicMock()
-        help_mock2.returncode = 0
-        help_mock2.stdout = "Usage: command\nOptions available"
+    assert await ums.shell_lookup("ls", timeout=0.05, startup_timeout=1) == "/usr/bin/ls"
 
-        mock_safe_execute.side_effect = [help_mock1, help_mock2]
+async def test_close_shell(ums, mock_exec):
+    """Test close_shell stops the running lookup shell"""
+    shell = _fake_shell(LS_PATH.stdout)
+    mock_exec.return_value = shell
+    await ums.shell_lookup("ls")
 
-        # We need to patch re.search to control the regex matching behavior
-        with patch('re.search') as mock_re_search:
-            # Make the first regex check for --help fail, second for -h succeed
-            mock_re_search.side_effect = [False, False, True]
+    await ums.close_shell()
 
-            result = unix_manual_server.search_help_documentation("command", "/usr/bin/command")
+    shell.kill.assert_called_once()
+    assert ums._shell_proc is None
 
-            assert "Help output for 'command'" in result
-            assert "Usage: command" in result
-            mock_logger.info.assert_called_with("Found help documentation using -h for command")
+async def test_safe_execute_success(ums, mock_exec, mock_logger, logged):
+    """Test safe_execute when command succeeds"""
+    # Configure the mock to return successful execution
+    mock_exec.return_value = _fake_proc(OK)
+
+    result = await ums.safe_execute(["ls", "-l"])
+
+    assert (result.args, result.returncode, result.stdout, result.stderr) == (["ls", "-l"], 0, "output", "")
+    # The server's stdin is the MCP channel, so children must not inherit it
+    mock_exec.assert_called_once_with(
+        "ls", "-l",
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=None
+    )
+    calls = logged(mock_logger.debug)
+    assert (("Executing command: ['ls', '-l'] with timeout=10",), ()) in calls
+    assert (("Command exit code: 0",), ()) in calls
+    assert (("Command stdout first 100 chars: output",), ()) in calls
 
-def test_search_help_documentation_with_help_subcommand(mock_logger):
-    """Test search_help_documentation with help subcommand"""
-    with patch('unix_manual_server.safe_execute') as mock_safe_execute:
-        # First two calls return outputs that don't match help pattern
-        help_mock1 = MagicMock()
-        help_mock1.returncode = 0
-        help_mock1.stdout = "Some output that doesn't look like help"
+async def test_safe_execute_timeout(ums, mock_exec, mock_logger):
+    """Test safe_execute kills the command when it times out"""
+    proc = _fake_proc(read=_hang)
+    mock_exec.return_value = proc
 
-        help_mock2 = MagicMock()
-        help_mock2.returncode = 0
-        help_mock2.stdout = "Another output that doesn't look like help"
+    result = await ums.safe_execute(["ls", "-l"], timeout=0.01)
 
-        # Third call returns valid help
-        help_mock3 = MagicMock()
-        help_mock3.returncode = 0
-        help_mock3.stdout = "Usage: command\nOptions available"
+    assert result is None
+    proc.kill.assert_called_once()
+    # The killed process is reaped rather than left as a zombie
+    assert proc.method_calls[-2:] == [("kill",), ("wait",)]
+    mock_logger.warning.assert_called_once()
 
-        mock_safe_execute.side_effect = [help_mock1, help_mock2, help_mock3]
+async def test_safe_execute_output_limit(ums, mock_exec):
+    """Test safe_execute keeps only the first _OUTPUT_LIMIT bytes of a huge output"""
+    mock_exec.return_value = _fake_proc(NS(stdout="x" * (ums._OUTPUT_LIMIT + 1000), returncode=0, stderr=""))
 
-        # We need to patch re.search to control the regex matching behavior
-        with patch('re.search') as mock_re_search:
-            # First four regex checks fail (two for --help, two for -h), last one succeeds
-            mock_re_search.side_effect = [False, False, False, False, True]
+    result = await ums.safe_execute(["man", "bash"])
 
-            result = unix_manual_server.search_help_documentation("command", "/usr/bin/command")
+    # The rest is drained, so the command still exits normally
+    assert result.returncode == 0
+    assert len(result.stdout) == ums._OUTPUT_LIMIT
 
-            assert "Help output for 'command'" in result
-            assert "Usage: command" in result
-            mock_logger.info.assert_called_with("Found help documentation using help subcommand for command")
+async def test_safe_execute_cancelled(ums, mock_exec):
+    """Test safe_execute kills the command when the caller cancels it"""
+    proc = _fake_proc(read=_hang)
+    mock_exec.return_value = proc
 
-def test_search_help_documentation_no_help_found(mock_logger):
-    """Test search_help_documentation when no help found"""
-    with patch('unix_manual_server.safe_execute') as mock_safe_execute:
-        # All calls return no match
-        help_mock = MagicMock()
-        help_mock.returncode = 0
-        help_mock.stdout = "Some output that doesn't look like help"
+    task = asyncio.create_task(ums.safe_execute(["ls", "-l"]))
+    while not proc.stdout.read.called:
+        await asyncio.sleep(0)
+    task.cancel()
 
-        mock_safe_execute.return_value = help_mock
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    proc.kill.assert_called_once()
 
-        # Mock regex search to always return False
-        with patch('re.search') as mock_re_search:
-            mock_re_search.return_value = False
+async def test_safe_execute_error(ums, mock_exec, mock_logger):
+    """Test safe_execute when the command cannot be started"""
+    # Configure the mock to raise FileNotFoundError
+    mock_exec.side_effect = FileNotFoundError("No such file or directory: 'ls'")
 
-            result = unix_manual_server.search_help_documentation("command", "/usr/bin/command")
+    result = await ums.safe_execute(["ls", "-l"])
 
-            assert result == ""
-            assert mock_safe_execute.call_count == 3
-            mock_logger.warning.assert_called_with("No help documentation found for command")
+    assert result is None
+    mock_exec.assert_called_once()
+    mock_logger.error.assert_called_once()
 
-def test_get_command_documentation_with_script_path(mock_logger):
+@pytest.mark.parametrize(
+    "name,expected",
+    [
+        ("ls", True),
+        ("python3.13", True),
+        ("git-lfs", True),
+        ("apt_get", True),
+        ("", False),
+        ("ls;rm", False),
+        ("ls\n", False),
+        ("$(id)", False),
+        ("lś", False),
+    ]
+)
+def test_is_valid_command_name(ums, name, expected):
+    """Test is_valid_command_name accepts exactly the allowed characters"""
+    assert ums.is_valid_command_name(name) is expected
+
+@pytest.mark.parametrize(
+    "output,expected",
+    [
+        ("Usage: ls [OPTION]... [FILE]...", True),
+        ("OPTIONS\n  -a  all", True),
+        ("jq-1.7.1", True),
+        ("file1.txt\nfile2.txt", False),
+        # Keywords past the scan limit are ignored
+        ("x" * 4096 + "\nusage: late", False),
+    ]
+)
+def test_looks_like_help(ums, output, expected):
+    """Test looks_like_help keyword and version detection"""
+    assert ums.looks_like_help(output) is expected
+
+@pytest.mark.parametrize(
+    "probe_results,help_re_side_effects,expected_substring,expected_log",
+    [
+        # --help output doesn't look like help, -h succeeds
+        ({"--help": NOT_HELP, "-h": USAGE}, [None, True], "Usage: command",
+         ("info", "Found help documentation using -h for command")),
+        # --help and -h fail, help subcommand succeeds
+        ({"--help": NOT_HELP, "-h": NOT_HELP, "help": USAGE}, [None, None, True], "Usage: command",
+         ("info", "Found help documentation using help subcommand for command")),
+        # No help found at all
+        ({"--help": NOT_HELP, "-h": NOT_HELP, "help": NOT_HELP}, [None] * 3, "",
+         ("warning", "No help documentation found for command")),
+    ]
+)
+async def test_search_help_documentation(ums, probe_results, help_re_side_effects,
+                                   expected_substring, expected_log, mock_logger):
+    """Test search_help_documentation falling through --help, -h and help"""
+    def fake_safe_execute(cmd_args, timeout):
+        return probe_results.get(cmd_args[-1])
+
+    with patch('unix_manual_server.safe_execute', side_effect=fake_safe_execute) as mock_safe_execute, \
+         patch.object(ums, "_HELP_RE") as mock_help_re:
+        mock_help_re.search.side_effect = help_re_side_effects
+        result = await ums.search_help_documentation("command", "/usr/bin/command")
+
+    assert expected_substring in result
+    if expected_substring:
+        assert "Help output for 'command'" in result
+    else:
+        assert result == ""
+    # Each option only runs once the ones before it have failed
+    assert [call.args[0][-1] for call in mock_safe_execute.call_args_list] == list(probe_results)
+    level, message = expected_log
+    getattr(mock_logger, level).assert_called_with(message)
+
+async def test_search_help_documentation_help_first(ums):
+    """Test -h and the bare help argument are never run when --help works"""
+    with patch('unix_manual_server.safe_execute', return_value=USAGE) as mock_safe_execute:
+        result = await ums.search_help_documentation("mkdir", "/usr/bin/mkdir")
+
+    assert result == "Help output for 'mkdir':\n\nUsage: command\nOptions available"
+    mock_safe_execute.assert_called_once_with(["/usr/bin/mkdir", "--help"], timeout=5)
+
+async def test_search_help_documentation_not_strict(ums, mock_logger):
+    """Test that unmatched --help output is returned when strict=False"""
+    with patch('unix_manual_server.safe_execute', return_value=NOT_HELP) as mock_safe_execute, \
+         patch.object(ums, "_HELP_RE") as mock_help_re:
+        mock_help_re.search.return_value = None
+        result = await ums.search_help_documentation("command", "/usr/bin/command", strict=False)
+
+    assert result == f"Help output for 'command':\n\n{NOT_HELP.stdout}"
+    assert mock_safe_execute.call_count == 3
+    mock_logger.info.assert_called_with("Using unmatched --help output for command")
+
+async def test_get_command_documentation_with_script_path(ums, mock_logger, logged):
     """Test that script paths like 'python script.py' are handled correctly"""
     with patch('unix_manual_server.get_command_path') as mock_get_path, \
          patch('unix_manual_server.search_help_documentation') as mock_search_help, \
@@ -232,10 +477,10 @@ def test_get_command_documentation_with_script_path(mock_logger):
         # Then fall back to main command
         mock_search_help.return_value = "Help output for 'python':\n\nPYTHON HELP CONTENT"
 
-        result = unix_manual_server.get_command_documentation(command, prefer_economic=True)
+        result = await ums.get_command_documentation(command, prefer_economic=True)
 
         assert "Help output for 'python'" in result
-        mock_logger.debug.assert_any_call("Detected subcommand: 'script.py', will try 'python script.py' first")
+        assert (("Detected subcommand: 'script.py', will try 'python script.py' first",), ()) in logged(mock_logger.debug)
 
 @pytest.mark.parametrize(
     "command,has_subcommand,subcommand_help_succeeds,expected_result",
@@ -248,8 +493,8 @@ def test_get_command_documentation_with_script_path(mock_logger):
         ("ls -la", False, False, "Help output for 'ls'"),
     ]
 )
-def test_get_command_documentation_with_subcommand(command, has_subcommand, subcommand_help_succeeds,
-                                                  expected_result, mock_logger):
+async def test_get_command_documentation_with_subcommand(ums, command, has_subcommand, subcommand_help_succeeds,
+                                                        expected_result, mock_logger, logged):
     """Test get_command_documentation with subcommands"""
     with patch('unix_manual_server.get_command_path') as mock_get_path, \
          patch('unix_manual_server.search_help_documentation') as mock_search_help, \
@@ -261,9 +506,7 @@ def test_get_command_documentation_with_subcommand(command, has_subcommand, subc
         if has_subcommand:
             if subcommand_help_succeeds:
                 # Subcommand help succeeds
-                subcommand_help_mock = MagicMock()
-                subcommand_help_mock.returncode = 0
-                subcommand_help_mock.stdout = "SUBCOMMAND HELP CONTENT"
+                subcommand_help_mock = NS(stdout="SUBCOMMAND HELP CONTENT", returncode=0, stderr="")
 
                 # The first three calls will be for the subcommand with --help, -h, help
                 # Return success for the first one to simulate --help working
@@ -276,12 +519,28 @@ def test_get_command_documentation_with_subcommand(command, has_subcommand, subc
             # No subcommand, main command help succeeds
             mock_search_help.return_value = f"Help output for '{command.split()[0]}':\n\nMAIN COMMAND HELP CONTENT"
 
-        result = unix_manual_server.get_command_documentation(command, prefer_economic=True)
+        result = await ums.get_command_documentation(command, prefer_economic=True)
 
         assert expected_result in result
 
         if has_subcommand:
-            mock_logger.debug.assert_any_call(f"Detected subcommand: '{command.split()[1]}', will try '{command.split()[0]} {command.split()[1]}' first")
+            main_command, subcommand = command.split()[:2]
+            message = f"Detected subcommand: '{subcommand}', will try '{main_command} {subcommand}' first"
+            assert ((message,), ()) in logged(mock_logger.debug)
+
+async def test_get_command_documentation_subcommand_probes(ums, mock_logger):
+    """Test the subcommand help probes stop at the first usable one, so help never runs"""
+    probe_results = {"--help": NOT_FOUND, "-h": NS(stdout="usage: git commit", returncode=0, stderr=""), "help": OK}
+    with patch('unix_manual_server.get_command_path', return_value="/usr/bin/git"), \
+         patch('unix_manual_server.safe_execute',
+               side_effect=lambda cmd_args, timeout: probe_results[cmd_args[-1]]) as mock_safe_execute:
+        result = await ums.get_command_documentation("git commit", prefer_economic=True)
+
+    assert result == "Help output for 'git commit':\n\nusage: git commit"
+    assert [c.args[0] for c in mock_safe_execute.call_args_list] == [
+        ["/usr/bin/git", "commit", "--help"], ["/usr/bin/git", "commit", "-h"]
+    ]
+    mock_logger.info.assert_any_call("Found help docs using -h for subcommand git commit")
 
 @pytest.mark.parametrize(
     "command,valid_name,command_exists,prefer_economic,man_section,expected_result",
@@ -302,24 +561,23 @@ def test_get_command_documentation_with_subcommand(command, has_subcommand, subc
         ("ls-all-fail", True, True, True, None, "No documentation available for 'ls-all-fail'"),
     ]
 )
-def test_get_command_documentation(command, valid_name, command_exists, prefer_economic,
-                                   man_section, expected_result, mock_logger):
+async def test_get_command_documentation(ums, command, valid_name, command_exists, prefer_economic,
+                                         man_section, expected_result, mock_logger):
     """Test get_command_documentation with various scenarios"""
     with patch('unix_manual_server.get_command_path') as mock_get_path, \
          patch('unix_manual_server.search_help_documentation') as mock_search_help, \
-         patch('subprocess.run') as mock_run, \
          patch('unix_manual_server.safe_execute') as mock_safe_execute:
 
         # Configure mocks based on parameters
         if not valid_name:
             # Return early due to invalid name check
-            result = unix_manual_server.get_command_documentation(command, prefer_economic, man_section)
+            result = await ums.get_command_documentation(command, prefer_economic, man_section)
             assert "Invalid command name" in result
             return
 
         if not command_exists:
             mock_get_path.return_value = None
-            result = unix_manual_server.get_command_documentation(command, prefer_economic, man_section)
+            result = await ums.get_command_documentation(command, prefer_economic, man_section)
             assert "Command not found" in result
             return
 
@@ -330,71 +588,152 @@ def test_get_command_documentation(command, valid_name, command_exists, prefer_e
             # Economic approach fails, man succeeds
             mock_search_help.return_value = ""
             # Mock the man page command success
-            man_result = MagicMock()
-            man_result.returncode = 0
-            man_result.stdout = "MAN PAGE CONTENT"
-
-            col_result = MagicMock()
-            col_result.stdout = "FORMATTED MAN PAGE"
-
-            mock_run.side_effect = [man_result, col_result]
-
-            # This is key - direct --help should also fail in this scenario
-            mock_safe_execute.return_value = None
+            mock_safe_execute.return_value = MAN_PAGE
         elif command == "ls-all-fail":
             # Both approaches fail
             mock_search_help.return_value = ""
             # Man command fails
-            man_result = MagicMock()
-            man_result.returncode = 1
-            man_result.stderr = "No manual entry"
-
-            mock_run.return_value = man_result
-            # Direct --help fails too
-            mock_safe_execute.return_value = None
+            mock_safe_execute.return_value = NO_MAN_PAGE
         else:
             # Standard success case
             if prefer_economic:
                 mock_search_help.return_value = f"Help output for '{command}':\n\nHELP CONTENT"
             else:
                 mock_search_help.return_value = ""
-                man_result = MagicMock()
-                man_result.returncode = 0
-                man_result.stdout = "MAN PAGE CONTENT"
-
-                col_result = MagicMock()
-                col_result.stdout = "FORMATTED MAN PAGE"
+                mock_safe_execute.return_value = MAN_PAGE
 
-                mock_run.side_effect = [man_result, col_result]
-
-        result = unix_manual_server.get_command_documentation(command, prefer_economic, man_section)
+        result = await ums.get_command_documentation(command, prefer_economic, man_section)
 
         assert expected_result in result
 
-def test_list_common_commands(mock_os_path_exists, mock_os_path_isdir,
-                               mock_os_path_isfile, mock_os_access,
-                               mock_os_listdir, mock_logger):
+async def test_get_command_documentation_man_plain_text(ums, mock_exec):
+    """Test that man runs without a pager and its overstrike formatting is stripped"""
+    mock_exec.side_effect = [
+        _fake_proc(MAN_PATH),
+        _fake_proc(NS(stdout="N\bNA\bAM\bME\bE\n  _\bl_\bs", returncode=0, stderr=""))
+    ]
+    with patch('unix_manual_server.get_command_path', return_value="/bin/ls"):
+        result = await ums.get_command_documentation("ls", prefer_economic=False, man_section=1)
+
+    assert result == "Manual page for 'ls':\n\nNAME\n  ls"
+    # The man -w check and a single man process, no col -b behind it
+    assert [c.args for c in mock_exec.call_args_list] == [("man", "-w", "1", "ls"), ("man", "1", "ls")]
+    assert mock_exec.call_args.kwargs["env"]["MANPAGER"] == "cat"
+
+async def test_get_command_documentation_man_timeout(ums, mock_exec, mock_logger):
+    """Test that man is killed when it times out"""
+    proc = _fake_proc(read=TimeoutError)
+    mock_exec.side_effect = [_fake_proc(MAN_PATH), proc]
+    with patch('unix_manual_server.get_command_path', return_value="/bin/ls"), \
+         patch('unix_manual_server.search_help_documentation', return_value=""):
+        result = await ums.get_command_documentation("ls", prefer_economic=False)
+
+    assert result == "No documentation available for 'ls'"
+    proc.kill.assert_called_once()
+    mock_logger.warning.assert_any_call("Command timed out after 10 seconds: ['man', 'ls']")
+
+async def test_get_command_documentation_no_man_page(ums, mock_logger):
+    """Test that man is not run when man -w finds no page, and that the miss is cached"""
+    with patch('unix_manual_server.get_command_path', return_value="/usr/bin/foo"), \
+         patch('unix_manual_server.search_help_documentation', return_value=""), \
+         patch('unix_manual_server.safe_execute', return_value=NO_MAN_PAGE) as mock_safe_execute:
+        result = await ums.get_command_documentation("foo", prefer_economic=False)
+        assert await ums.man_page_exists(["foo"]) is False
+
+    assert result == "No documentation available for 'foo'"
+    mock_safe_execute.assert_called_once_with(["man", "-w", "foo"], timeout=5)
+    mock_logger.info.assert_any_call("No man page found for foo")
+
+async def test_get_command_documentation_man_check_failed(ums):
+    """Test that man still runs when the man -w check itself fails, and the failure isn't cached"""
+    with patch('unix_manual_server.get_command_path', return_value="/bin/ls"), \
+         patch('unix_manual_server.safe_execute', side_effect=[None, MAN_PAGE]) as mock_safe_execute:
+        result = await ums.get_command_documentation("ls", prefer_economic=False)
+
+    assert result == "Manual page for 'ls':\n\nFORMATTED MAN PAGE"
+    assert mock_safe_execute.call_count == 2
+    assert not ums._MAN_CACHE
+
+async def test_get_command_documentation_cached(ums):
+    """Test that repeated documentation queries are served from the cache"""
+    with patch('unix_manual_server.get_command_path', return_value="/bin/ls") as mock_get_path, \
+         patch('unix_manual_server.search_help_documentation', return_value="Help output for 'ls'") as mock_search_help:
+        first = await ums.get_command_documentation("ls")
+        second = await ums.get_command_documentation("  ls ")
+        other = await ums.get_command_documentation("ls", man_section=1)
+
+    assert first == second == other == "Help output for 'ls'"
+    assert mock_get_path.call_count == 2
+    assert mock_search_help.call_count == 2
+
+def test_cache_expiry_and_eviction(ums):
+    """Test cache_get drops expired entries and cache_put evicts the least recently used"""
+    cache = {}
+    with patch('time.monotonic', return_value=100.0):
+        ums.cache_put(cache, "a", "A", maxsize=2)
+        ums.cache_put(cache, "b", "B", maxsize=2)
+        assert ums.cache_get(cache, "a") == "A"
+        ums.cache_put(cache, "c", "C", maxsize=2)
+    assert list(cache) == ["a", "c"]
+
+    with patch('time.monotonic', return_value=100.0 + ums._CACHE_TTL):
+        assert ums.cache_get(cache, "a") is None
+    assert "a" not in cache
+
+def test_list_common_commands(ums, mock_os_path_exists, mock_os_path_isdir,
+                               mock_os_access, mock_os_scandir, mock_logger, logged):
     """Test list_common_commands"""
-    result = unix_manual_server.list_common_commands()
+    result = ums.list_common_commands()
 
     assert "Common Unix commands available on this system:" in result
     assert "ls" in result
     assert "cat" in result
     assert "grep" in result
+    # Category members are listed in sorted order
+    assert "File Operations:\ngrep, ls\n" in result
+    assert "Text Processing:\ncat, grep\n" in result
     assert "Total commands found:" in result
-    mock_logger.info.assert_any_call("Listing common commands")
-    mock_logger.info.assert_any_call("Found 3 unique commands")
+    calls = logged(mock_logger.info)
+    assert (("Listing common commands",), ()) in calls
+    assert (("Found 3 unique commands",), ()) in calls
+    assert mock_os_scandir.call_count == 3
+    # Names repeated in later directories are only checked in the first one
+    assert mock_os_access.call_args_list == [
+        (('/bin/ls', os.X_OK),), (('/bin/cat', os.X_OK),), (('/bin/grep', os.X_OK),)
+    ]
+
+def test_list_common_commands_cached(ums, mock_os_scandir):
+    """Test list_common_commands only rescans when a directory changes"""
+    mtimes = (("/bin", 1), ("/usr/bin", 1), ("/usr/local/bin", None))
+    with patch('unix_manual_server.dir_mtimes', return_value=mtimes) as mock_mtimes:
+        first = ums.list_common_commands()
+        second = ums.list_common_commands()
+        assert mock_os_scandir.call_count == 3
+
+        mock_mtimes.return_value = (("/bin", 1), ("/usr/bin", 2), ("/usr/local/bin", None))
+        third = ums.list_common_commands()
+
+    assert first == second == third
+    assert mock_os_scandir.call_count == 6
+
+def test_list_common_commands_skips_non_executables(ums, mock_os_access, mock_os_scandir):
+    """Test list_common_commands ignores entries that are not executable files"""
+    mock_os_scandir.side_effect = _scandir(['README'], is_file=False)
 
-def test_list_common_commands_directory_error(mock_os_path_exists, mock_os_path_isdir, mock_logger):
+    result = ums.list_common_commands()
+
+    assert "Total commands found: 0" in result
+    mock_os_access.assert_not_called()
+
+def test_list_common_commands_directory_error(ums, mock_os_scandir, mock_logger):
     """Test list_common_commands with error listing directory"""
-    with patch('os.listdir') as mock_listdir:
-        mock_listdir.side_effect = OSError("Permission denied")
+    mock_os_scandir.side_effect = OSError("Permission denied")
 
-        result = unix_manual_server.list_common_commands()
+    result = ums.list_common_commands()
 
-        assert "Common Unix commands available on this system:" in result
-        assert "Total commands found: 0" in result
-        mock_logger.error.assert_called()
+    assert "Common Unix commands available on this system:" in result
+    assert "Total commands found: 0" in result
+    mock_logger.error.assert_called()
 
 @pytest.mark.parametrize(
     "command,valid_name,command_exists,version_output,expected_result",
@@ -409,7 +748,7 @@ def test_list_common_commands_directory_error(mock_os_path_exists, mock_os_path_
         ("nonexistent", True, False, None, "Command 'nonexistent' does not exist or is not in the PATH."),
     ]
 )
-def test_check_command_exists(command, valid_name, command_exists, version_output,
+async def test_check_command_exists(ums, command, valid_name, command_exists, version_output,
                               expected_result, mock_logger):
     """Test check_command_exists with various scenarios"""
     with patch('unix_manual_server.get_command_path') as mock_get_path, \
@@ -418,13 +757,13 @@ def test_check_command_exists(command, valid_name, command_exists, version_outpu
         # Configure mocks based on parameters
         if not valid_name:
             # Return early due to invalid name check
-            result = unix_manual_server.check_command_exists(command)
+            result = await ums.check_command_exists(command)
             assert "Invalid command name" in result
             return
 
         if not command_exists:
             mock_get_path.return_value = None
-            result = unix_manual_server.check_command_exists(command)
+            result = await ums.check_command_exists(command)
             assert "does not exist" in result
             return
 
@@ -433,34 +772,75 @@ def test_check_command_exists(command, valid_name, command_exists, version_outpu
 
         if version_output:
             # Command has version info
-            version_mock = MagicMock()
-            version_mock.returncode = 0
-            version_mock.stdout = version_output
-            mock_safe_execute.return_value = version_mock
+            mock_safe_execute.return_value = NS(stdout=version_output, returncode=0, stderr="")
         else:
             # Command has no version info
-            version_mock = MagicMock()
-            version_mock.returncode = 1
-            version_mock.stdout = ""
-            mock_safe_execute.return_value = version_mock
+            mock_safe_execute.return_value = NOT_FOUND
 
-        result = unix_manual_server.check_command_exists(command)
+        result = await ums.check_command_exists(command)
 
         assert expected_result in result
 
-def test_main_success():
+async def test_check_command_exists_version_subcommand(ums, mock_logger):
+    """Test that the version probes fall through --version and -V to the version subcommand"""
+    probe_results = {"-V": NOT_FOUND, "version": NS(stdout="go version go1.22", returncode=0, stderr="")}
+
+    def fake_safe_execute(cmd_args, timeout):
+        return probe_results.get(cmd_args[-1])
+
+    with patch('unix_manual_server.get_command_path', return_value="/usr/bin/go"), \
+         patch('unix_manual_server.safe_execute', side_effect=fake_safe_execute) as mock_safe_execute:
+        result = await ums.check_command_exists("go")
+
+    assert result == "Command 'go' exists at /usr/bin/go.\nVersion information: go version go1.22"
+    assert [c.args[0][-1] for c in mock_safe_execute.call_args_list] == ["--version", "-V", "version"]
+    mock_logger.debug.assert_called_with("Got version info using version subcommand for go")
+
+async def test_check_command_exists_version_first(ums):
+    """Test -V and the bare version argument are never run when --version works"""
+    with patch('unix_manual_server.get_command_path', return_value="/usr/bin/touch"), \
+         patch('unix_manual_server.safe_execute', return_value=NS(stdout="touch 9.4", returncode=0, stderr="")) as mock_safe_execute:
+        result = await ums.check_command_exists("touch")
+
+    assert result == "Command 'touch' exists at /usr/bin/touch.\nVersion information: touch 9.4"
+    mock_safe_execute.assert_called_once_with(["/usr/bin/touch", "--version"], timeout=5)
+
+async def test_check_command_exists_cached(ums):
+    """Test that repeated existence checks are served from the cache"""
+    with patch('unix_manual_server.get_command_path', return_value="/bin/ls") as mock_get_path, \
+         patch('unix_manual_server.safe_execute', return_value=NS(stdout="ls 9.4", returncode=0, stderr="")):
+        first = await ums.check_command_exists("ls")
+        second = await ums.check_command_exists("ls -la")
+
+    assert first == second
+    mock_get_path.assert_called_once_with("ls")
+
+async def test_failed_lookups_not_cached(ums):
+    """Test that results produced while a command timed out or failed are not cached"""
+    async def failing_lookup(command):
+        ums.note_failure()
+        return None
+
+    with patch('unix_manual_server.get_command_path', side_effect=failing_lookup) as mock_get_path:
+        assert await ums.check_command_exists("ls") == await ums.check_command_exists("ls")
+        assert await ums.get_command_documentation("ls") == await ums.get_command_documentation("ls")
+
+    assert mock_get_path.call_count == 4
+    assert not ums._EXISTS_CACHE and not ums._DOC_CACHE
+
+def test_main_success(ums):
     """Test main function successful execution"""
     with patch('unix_manual_server.mcp.run') as mock_run, \
          patch('unix_manual_server.logger') as mock_logger:
-        unix_manual_server.main()
+        ums.main()
         mock_run.assert_called_once()
         mock_logger.info.assert_called_with("Starting unix-manual-server")
 
-def test_main_exception():
+def test_main_exception(ums):
     """Test main function with exception"""
     with patch('unix_manual_server.mcp.run') as mock_run, \
          patch('unix_manual_server.logger') as mock_logger:
         mock_run.side_effect = Exception("Test error")
-        unix_manual_server.main()
+        ums.main()
         mock_run.assert_called_once()
         mock_logger.critical.assert_called_once()
@@ -1,7 +1,14 @@
+import asyncio
+import contextlib
 import os
 import re
+import shlex
+import shutil
+import string
 import subprocess
+import time
 import logging
+import logging.handlers
 from mcp.server.fastmcp import FastMCP
 
 # Configure logging
@@ -9,150 +16,354 @@ from mcp.server.fastmcp import FastMCP
 script_dir = os.path.dirname(os.path.abspath(__file__))
 log_file = os.path.join(script_dir, "unix-manual-server.log")
 
+# Set UNIX_MANUAL_LOG_LEVEL=DEBUG to trace every command the server runs
+log_level_name = os.environ.get("UNIX_MANUAL_LOG_LEVEL", "INFO").upper()
+# getLevelName returns a number only for known level names
+log_level = logging.getLevelName(log_level_name)
+unknown_log_level = not isinstance(log_level, int)
+if unknown_log_level:
+    log_level = logging.INFO
+
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=log_level,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler(log_file),
+        logging.handlers.RotatingFileHandler(log_file, maxBytes=1_048_576, backupCount=3),
         logging.StreamHandler()
     ]
 )
 logger = logging.getLogger("unix-manual-server")
 logger.info(f"Logging to: {log_file}")
+if unknown_log_level:
+    logger.warning(f"Unknown UNIX_MANUAL_LOG_LEVEL '{log_level_name}', using INFO")
 
-# Create an MCP server instance
-mcp = FastMCP("unix-manual-server")
-
-def get_command_path(command):
-    """Get the full absolute path to a command by filtering shell output."""
-    logger.debug(f"Searching for command path: {command}")
+@contextlib.asynccontextmanager
+async def lifespan(server):
+    """Stop the lookup shell when the server shuts down."""
     try:
-        # Use the user's shell (defaulting to /bin/zsh) with login to load the full environment.
-        user_shell = os.environ.get('SHELL', '/bin/zsh')
-        logger.debug(f"Using shell: {user_shell}")
-        result = subprocess.run(
-            [user_shell, "-l", "-c", f"command -v {command} 2>/dev/null"],
-            capture_output=True,
-            text=True
-        )
-        # Process the output line by line and return the first line that is a valid absolute path.
-        for line in result.stdout.splitlines():
-            if re.match(r'^/', line):
-                path = line.strip()
-                logger.debug(f"Found command path: {path}")
-                return path
-        logger.warning(f"Command not found: {command}")
+        yield
+    finally:
+        await close_shell()
+
+# Create an MCP server instance
+mcp = FastMCP("unix-manual-server", lifespan=lifespan)
+
+# Valid command name characters (basic check to prevent injection); translating
+# them away leaves only the invalid ones, which is cheaper than a regex match
+_VALID_CMD_TABLE = str.maketrans("", "", string.ascii_letters + string.digits + "_.-")
+
+# Precompiled patterns used on every tool call
+# Most help text contains words like "usage", "options" or "help"
+_HELP_RE = re.compile(r'usage|options|help|version', re.IGNORECASE)
+# Version number pattern
+_VERSION_RE = re.compile(r'\d+\.\d+\.\d+')
+# Help keywords almost always appear near the top, so only scan this many characters
+_HELP_SCAN_LIMIT = 2048
+# Only keep this many bytes of a command's stdout or stderr
+_OUTPUT_LIMIT = 256 * 1024
+# Backspace overstrike (bold "X\bX", underline "_\bX") left in unpaged man output
+_OVERSTRIKE_RE = re.compile(r'.\x08')
+
+# Have man write plain text to its stdout instead of starting a pager
+_MAN_ENV = {**os.environ, "MANPAGER": "cat", "MANWIDTH": "80", "GROFF_NO_SGR": "1"}
+
+# Tool results are cached for repeated queries within a session
+_CACHE_TTL = 600
+_CACHE_MAXSIZE = 256
+_DOC_CACHE: dict[tuple, tuple[float, str]] = {}
+_EXISTS_CACHE: dict[str, tuple[float, str]] = {}
+_PATH_CACHE: dict[str, tuple[float, str]] = {}
+# Whether `man -w` found a page, so missing pages aren't searched for again
+_MAN_CACHE: dict[tuple, tuple[float, bool]] = {}
+# Keyed on the scanned directories' mtimes, which change whenever a command is added or removed
+_COMMON_CACHE: dict[tuple, tuple[float, str]] = {}
+# Bumped whenever a command times out or fails to start, so tool results that
+# may have been cut short by it aren't cached
+_failure_count = 0
+
+# Long-lived login shell answering `command -v` for commands that are only on the
+# profile-configured PATH, so a session pays for one shell startup instead of one per lookup
+_SHELL_SENTINEL = "__UNIX_MANUAL_END__"
+# Login profiles (conda, nvm, ...) can take a while, so startup gets more time than a query
+_SHELL_STARTUP_TIMEOUT = 30
+_shell_proc = None
+_shell_lock = asyncio.Lock()
+
+# Command categories shown by list_common_commands
+_FILE_CMDS = frozenset({'ls', 'cp', 'mv', 'rm', 'mkdir', 'touch', 'chmod', 'chown', 'find', 'grep'})
+_TEXT_CMDS = frozenset({'cat', 'less', 'more', 'head', 'tail', 'grep', 'sed', 'awk', 'sort', 'uniq', 'wc'})
+_SYS_CMDS = frozenset({'ps', 'top', 'htop', 'df', 'du', 'free', 'uname', 'uptime', 'who', 'whoami'})
+_NET_CMDS = frozenset({'ping', 'netstat', 'ifconfig', 'ip', 'ssh', 'scp', 'curl', 'wget'})
+
+def cache_get(cache, key, ttl=_CACHE_TTL):
+    """Return the cached value for key, or None if it is missing or older than ttl seconds."""
+    entry = cache.get(key)
+    if entry is None:
         return None
-    except subprocess.SubprocessError as e:
-        logger.error(f"Error finding command path for {command}: {str(e)}")
+    timestamp, value = entry
+    if time.monotonic() - timestamp >= ttl:
+        del cache[key]
         return None
-
-def safe_execute(cmd_args, timeout=10):
+    # Move to the end so the least recently used entry is evicted first
+    cache[key] = cache.pop(key)
+    return value
+
+def cache_put(cache, key, value, maxsize=_CACHE_MAXSIZE):
+    """Store value under key, evicting the least recently used entries beyond maxsize."""
+    cache.pop(key, None)
+    cache[key] = (time.monotonic(), value)
+    while len(cache) > maxsize:
+        del cache[next(iter(cache))]
+
+def note_failure():
+    """Record that a command timed out or failed to start."""
+    global _failure_count
+    _failure_count += 1
+
+async def get_command_path(command):
+    """Get the full absolute path to a command.
+
+    The PATH is searched in-process first; the long-lived login shell is only
+    asked when that fails, which finds commands on the PATH set up by the
+    user's profile files but not ours. Found paths are cached.
+    """
+    logger.debug(f"Searching for command path: {command}")
+    path = cache_get(_PATH_CACHE, command)
+    if path:
+        logger.debug(f"Found cached command path: {path}")
+        return path
+    path = shutil.which(command)
+    if path:
+        logger.debug(f"Found command path: {path}")
+        cache_put(_PATH_CACHE, command, path, maxsize=512)
+        return path
+
+    output = await shell_lookup(command)
+    if output is None:
+        return None
+    # Process the output line by line and return the first line that is a valid absolute path.
+    for line in output.splitlines():
+        if line.startswith('/'):
+            path = line.strip()
+            logger.debug(f"Found command path: {path}")
+            cache_put(_PATH_CACHE, command, path, maxsize=512)
+            return path
+    logger.warning(f"Command not found: {command}")
+    return None
+
+async def _kill(proc):
+    """Kill a subprocess that may already have exited and reap it."""
+    with contextlib.suppress(ProcessLookupError):
+        proc.kill()
+    await proc.wait()
+
+async def _start_shell():
+    """Start the lookup shell, reading commands from its stdin."""
+    # Use the user's shell (defaulting to /bin/zsh) as a login shell so it sees the PATH
+    # set up by the profile files (e.g. Homebrew) even when the MCP host started us
+    # with a minimal one. It is long-lived, so the profiles are only sourced once.
+    # No -i: an interactive shell on a pipe prints prompts into the answers.
+    user_shell = os.environ.get('SHELL', '/bin/zsh')
+    logger.debug(f"Starting lookup shell: {user_shell}")
+    return await asyncio.create_subprocess_exec(
+        user_shell, "-l",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+
+async def close_shell():
+    """Stop the lookup shell, if one is running."""
+    global _shell_proc
+    if _shell_proc is not None:
+        proc, _shell_proc = _shell_proc, None
+        await _kill(proc)
+
+async def _read_until_sentinel(stream):
+    """Read lines from the lookup shell until the end-of-answer sentinel."""
+    lines = []
+    while True:
+        line = await stream.readline()
+        if not line:
+            raise EOFError("lookup shell exited")
+        line = line.decode(errors="replace").rstrip("\n")
+        if line == _SHELL_SENTINEL:
+            return "\n".join(lines)
+        lines.append(line)
+
+async def shell_lookup(command, timeout=5, startup_timeout=_SHELL_STARTUP_TIMEOUT):
+    """Return the output of `command -v` for command from the lookup shell, or None on failure.
+
+    The shell is started on first use, with startup_timeout seconds to get through
+    its profile files, and replaced if it dies or stops answering.
+    """
+    global _shell_proc
+    async with _shell_lock:
+        started = False
+        if _shell_proc is None or _shell_proc.returncode is not None:
+            try:
+                _shell_proc = await _start_shell()
+            except OSError as e:
+                logger.error(f"Error starting lookup shell: {str(e)}")
+                note_failure()
+                return None
+            started = True
+        proc = _shell_proc
+        try:
+            if started:
+                # Skip anything the profile files print before the first answer; the
+                # bare echo puts the sentinel on its own line even if they didn't end one
+                proc.stdin.write(f"echo; echo {_SHELL_SENTINEL}\n".encode())
+                await proc.stdin.drain()
+                await asyncio.wait_for(_read_until_sentinel(proc.stdout), startup_timeout)
+            proc.stdin.write(f"command -v {shlex.quote(command)} 2>/dev/null; echo {_SHELL_SENTINEL}\n".encode())
+            await proc.stdin.drain()
+            return await asyncio.wait_for(_read_until_sentinel(proc.stdout), timeout)
+        except (TimeoutError, EOFError, OSError) as e:
+            # A wedged or dead shell would answer later queries out of step, so replace it
+            logger.warning(f"Lookup shell failed for {command}: {e!r}")
+            note_failure()
+            _shell_proc = None
+            await _kill(proc)
+            return None
+        except asyncio.CancelledError:
+            _shell_proc = None
+            await _kill(proc)
+            raise
+
+async def _read_capped(stream, limit=_OUTPUT_LIMIT):
+    """Read a stream to EOF, keeping only its first limit bytes."""
+    chunks = []
+    size = 0
+    while chunk := await stream.read(65536):
+        # Keep draining past the limit so the child isn't blocked on a full pipe
+        if size < limit:
+            chunks.append(chunk[:limit - size])
+        size += len(chunk)
+    if size > limit:
+        logger.debug(f"Discarded {size - limit} bytes of output beyond {limit}")
+    return b"".join(chunks)
+
+async def safe_execute(cmd_args, timeout=10, env=None):
     """Safely execute a command directly (not through shell) and return its output."""
     logger.debug(f"Executing command: {cmd_args} with timeout={timeout}")
     try:
         # Execute command directly without shell
-        result = subprocess.run(
-            cmd_args,
-            capture_output=True,
-            text=True,
-            timeout=timeout,
-            shell=False  # Explicitly set shell=False for security
+        # Children must not read the server's stdin, which carries the MCP protocol
+        proc = await asyncio.create_subprocess_exec(
+            *cmd_args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env
         )
-        logger.debug(f"Command exit code: {result.returncode}")
-        # Add debug output to see first 100 chars of stdout
-        if result.stdout:
-            logger.debug(f"Command stdout first 100 chars: {result.stdout[:100].replace('\n', '\\n')}")
-        return result
-    except subprocess.TimeoutExpired:
-        logger.warning(f"Command timed out after {timeout} seconds: {cmd_args}")
-        return None
-    except (subprocess.SubprocessError, FileNotFoundError, OSError) as e:
+    except OSError as e:
         logger.error(f"Error executing command {cmd_args}: {str(e)}")
+        note_failure()
         return None
 
-def search_help_documentation(main_command, command_path):
-    """Search for help documentation using --help, -h, or help options."""
-    logger.info(f"Searching for help documentation for command: {main_command} at {command_path}")
+    try:
+        stdout, stderr, _ = await asyncio.wait_for(
+            asyncio.gather(_read_capped(proc.stdout), _read_capped(proc.stderr), proc.wait()),
+            timeout
+        )
+    except TimeoutError:
+        await _kill(proc)
+        logger.warning(f"Command timed out after {timeout} seconds: {cmd_args}")
+        note_failure()
+        return None
+    except asyncio.CancelledError:
+        # Don't leave the process running when the caller gives up on it
+        await _kill(proc)
+        raise
+
+    result = subprocess.CompletedProcess(
+        cmd_args,
+        proc.returncode,
+        stdout.decode(errors="replace"),
+        stderr.decode(errors="replace")
+    )
+    logger.debug(f"Command exit code: {result.returncode}")
+    # Add debug output to see first 100 chars of stdout, only building it when it will be logged
+    if result.stdout and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Command stdout first 100 chars: {result.stdout[:100].replace('\n', '\\n')}")
+    return result
+
+def is_valid_command_name(name):
+    """Check that a command name is non-empty and only uses letters, digits, '_', '.' and '-'."""
+    return bool(name) and not name.translate(_VALID_CMD_TABLE)
+
+def looks_like_help(output):
+    """Check whether command output looks like help text rather than regular output."""
+    head = output[:_HELP_SCAN_LIMIT]
+    return bool(_HELP_RE.search(head) or _VERSION_RE.search(head))
+
+async def search_help_documentation(main_command, command_path, strict=True):
+    """Search for help documentation using --help, -h, or help options.
 
-    # Try --help
-    logger.debug(f"Trying --help for {main_command}")
-    help_result = safe_execute([command_path, "--help"], timeout=5)
-    if help_result and help_result.returncode < 2 and help_result.stdout.strip():
+    With strict=False, --help output that doesn't look like help text is
+    still returned when none of the options produce anything better.
+    """
+    logger.info(f"Searching for help documentation for command: {main_command} at {command_path}")
+    loose_output = None
+
+    # Try the options one at a time: -h and especially a bare "help" argument can
+    # have side effects (mkdir help, touch help), so they only run when --help fails
+    labels = {"--help": "--help", "-h": "-h", "help": "help subcommand"}
+    for option, label in labels.items():
+        logger.debug(f"Trying {label} for {main_command}")
+        help_result = await safe_execute([command_path, option], timeout=5)
+        if not (help_result and help_result.returncode < 2 and help_result.stdout.strip()):
+            continue
         # Verify this is actual help text, not just command execution output
         output = help_result.stdout.strip()
-        # Most help text contains words like "usage", "options", or "help"
-        # Adding additional terms "USAGE" and checking for version string patterns
-        if (re.search(r'usage|options|help|Usage|Options|Help|USAGE|OPTIONS|HELP|USAGE:|VERSION|Version', output, re.IGNORECASE) or
-            re.search(r'\d+\.\d+\.\d+', output)):  # Version number pattern
-            logger.info(f"Found help documentation using --help for {main_command}")
-            return f"Help output for '{main_command}':\n\n{output}"
+        if option == "help":
+            # A help subcommand is only trusted on help keywords, not version strings
+            matched = _HELP_RE.search(output[:_HELP_SCAN_LIMIT])
         else:
-            # Add debug output to see what we're getting
-            logger.debug(f"--help output did not match help text pattern:\n{output[:200]}...")
-
-    # Try -h
-    logger.debug(f"Trying -h for {main_command}")
-    help_result = safe_execute([command_path, "-h"], timeout=5)
-    if help_result and help_result.returncode < 2 and help_result.stdout.strip():
-        output = help_result.stdout.strip()
-        if (re.search(r'usage|options|help|Usage|Options|Help|USAGE|OPTIONS|HELP|USAGE:|VERSION|Version', output, re.IGNORECASE) or
-            re.search(r'\d+\.\d+\.\d+', output)):  # Version number pattern
-            logger.info(f"Found help documentation using -h for {main_command}")
+            matched = looks_like_help(output)
+        if matched:
+            logger.info(f"Found help documentation using {label} for {main_command}")
             return f"Help output for '{main_command}':\n\n{output}"
-        else:
-            logger.debug(f"-h output did not match help text pattern:\n{output[:200]}...")
+        # Add debug output to see what we're getting
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"{label} output did not match help text pattern:\n{output[:200]}...")
+        if option == "--help":
+            loose_output = output
 
-    # Try help
-    logger.debug(f"Trying help subcommand for {main_command}")
-    help_result = safe_execute([command_path, "help"], timeout=5)
-    if help_result and help_result.returncode < 2 and help_result.stdout.strip():
-        output = help_result.stdout.strip()
-        if re.search(r'usage|options|help|Usage|Options|Help|USAGE|OPTIONS|HELP', output, re.IGNORECASE):
-            logger.info(f"Found help documentation using help subcommand for {main_command}")
-            return f"Help output for '{main_command}':\n\n{output}"
-        else:
-            logger.debug(f"help subcommand output did not match help text pattern:\n{output[:200]}...")
+    if not strict and loose_output:
+        logger.info(f"Using unmatched --help output for {main_command}")
+        return f"Help output for '{main_command}':\n\n{loose_output}"
 
     # If we get here, no valid help documentation was found
     logger.warning(f"No help documentation found for {main_command}")
     return ""
 
-@mcp.tool()
-def get_command_documentation(command: str, prefer_economic: bool = True, man_section: int = None) -> str:
-    """
-    Get documentation for a command in Unix-like system.
-
-    Args:
-        command: The command to get documentation for (no arguments)
-        prefer_economic: Whether to prefer the economic approach (--help/-h/help) [default: True]
-        man_section: Specific manual section to look in (1-9) [optional]
+async def man_page_exists(man_args):
+    """Check whether man has a page for man_args ([section,] command) without formatting it.
 
-    Returns:
-        The command documentation as a string
+    Both answers are cached. If the check itself fails (timeout, man missing)
+    this returns True uncached, so man still gets a chance to render the page.
     """
-    logger.info(f"Getting documentation for command: '{command}', prefer_economic={prefer_economic}, man_section={man_section}")
-
-    # Parse the command input to separate main command from subcommands/arguments
-    parts = command.strip().split()
-    main_command = parts[0]  # Extract the base command
-    logger.debug(f"Main command: {main_command}")
-
-    # Check if there's a subcommand (at least 2 parts and not an option)
-    has_subcommand = len(parts) > 1 and not parts[1].startswith('-')
-    subcommand = parts[1] if has_subcommand else None
+    key = tuple(man_args)
+    cached = cache_get(_MAN_CACHE, key)
+    if cached is not None:
+        return cached
+    # man -w only resolves the page's path, which is much cheaper than rendering it
+    result = await safe_execute(["man", "-w", *man_args], timeout=5)
+    if result is None:
+        return True
+    exists = result.returncode == 0
+    cache_put(_MAN_CACHE, key, exists)
+    return exists
+
+async def find_command_documentation(command, main_command, subcommand, prefer_economic, man_section):
+    """Look up documentation for an already validated command, trying the subcommand first if given."""
+    has_subcommand = subcommand is not None
     cmd_with_subcommand = f"{main_command} {subcommand}" if has_subcommand else None
 
-    if has_subcommand:
-        logger.debug(f"Detected subcommand: '{subcommand}', will try '{cmd_with_subcommand}' first")
-
-    # Validate command name (basic check to prevent injection)
-    if not re.match(r'^[a-zA-Z0-9_\.-]+$', main_command):
-        logger.warning(f"Invalid command name: '{main_command}'")
-        return f"Invalid command name: '{main_command}'"
-
     # Get full path to command
-    command_path = get_command_path(main_command)
+    command_path = await get_command_path(main_command)
     if not command_path:
         logger.warning(f"Command not found: '{main_command}'")
         return f"Command not found: '{main_command}'"
@@ -161,42 +372,25 @@ def get_command_documentation(command: str, prefer_economic: bool = True, man_se
     if has_subcommand and prefer_economic:
         logger.debug(f"Trying economic approach for subcommand: {cmd_with_subcommand}")
 
-        # Try --help for subcommand
-        help_cmd = safe_execute([command_path, subcommand, "--help"], timeout=5)
-        if help_cmd and help_cmd.stdout and help_cmd.returncode < 2:
-            logger.info(f"Found help docs using --help for subcommand {cmd_with_subcommand}")
-            return f"Help output for '{cmd_with_subcommand}':\n\n{help_cmd.stdout.strip()}"
-
-        # Try -h for subcommand
-        help_cmd = safe_execute([command_path, subcommand, "-h"], timeout=5)
-        if help_cmd and help_cmd.stdout and help_cmd.returncode < 2:
-            logger.info(f"Found help docs using -h for subcommand {cmd_with_subcommand}")
-            return f"Help output for '{cmd_with_subcommand}':\n\n{help_cmd.stdout.strip()}"
-
-        # Try help subcommand for subcommand
-        help_cmd = safe_execute([command_path, subcommand, "help"], timeout=5)
-        if help_cmd and help_cmd.stdout and help_cmd.returncode < 2:
-            logger.info(f"Found help docs using help subcommand for {cmd_with_subcommand}")
-            return f"Help output for '{cmd_with_subcommand}':\n\n{help_cmd.stdout.strip()}"
+        # Try --help, -h and the help subcommand one at a time, like for the main command:
+        # "cmd sub help" can have side effects, so it only runs when the others fail
+        labels = {"--help": "--help for subcommand", "-h": "-h for subcommand", "help": "help subcommand for"}
+        for option, label in labels.items():
+            help_cmd = await safe_execute([command_path, subcommand, option], timeout=5)
+            if help_cmd and help_cmd.stdout and help_cmd.returncode < 2:
+                logger.info(f"Found help docs using {label} {cmd_with_subcommand}")
+                return f"Help output for '{cmd_with_subcommand}':\n\n{help_cmd.stdout.strip()}"
 
         logger.debug(f"No help documentation found for subcommand {cmd_with_subcommand}, falling back to main command")
 
     # Try economic approach for the main command
     if prefer_economic:
         logger.debug(f"Trying economic approach for main command: {main_command}")
-        help_result = search_help_documentation(main_command, command_path)
+        # Accept unmatched --help output too rather than re-running --help
+        help_result = await search_help_documentation(main_command, command_path, strict=False)
         if help_result:
             return help_result
 
-        # Direct check if the previous function failed but command exists
-        # Try direct approach for well-known patterns
-        if command_path:
-            # Try --help directly
-            help_cmd = safe_execute([command_path, "--help"], timeout=5)
-            if help_cmd and help_cmd.stdout and help_cmd.returncode < 2:
-                logger.info(f"Found help docs by direct --help check for {main_command}")
-                return f"Help output for '{main_command}':\n\n{help_cmd.stdout.strip()}"
-
     # Use man as fallback or if economic approach not preferred
     logger.debug(f"Trying man page for {main_command}")
     # Execute man directly without going through shell
@@ -206,38 +400,23 @@ def get_command_documentation(command: str, prefer_economic: bool = True, man_se
         logger.debug(f"Using man section {man_section}")
     man_args.append(main_command)
 
-    try:
-        # Use col to strip formatting from man output
+    if not await man_page_exists(man_args[1:]):
+        logger.info(f"No man page found for {main_command}")
+    else:
         logger.debug(f"Executing man command: {man_args}")
-        man_result = subprocess.run(
-            man_args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            timeout=10
-        )
-
-        # Pipe the man output through col to remove formatting
-        if man_result.returncode == 0:
-            logger.debug("Man command succeeded, processing with col")
-            col_result = subprocess.run(
-                ["col", "-b"],
-                input=man_result.stdout,
-                capture_output=True,
-                text=True
-            )
-            man_text = col_result.stdout
-            logger.info(f"Successfully retrieved man page for {main_command}")
-            return f"Manual page for '{main_command}':\n\n{man_text}"
-        else:
-            logger.warning(f"Man command failed with exit code {man_result.returncode}, stderr: {man_result.stderr}")
-    except Exception as e:
-        logger.error(f"Error executing man command for {main_command}: {str(e)}")
+        man_result = await safe_execute(man_args, timeout=10, env=_MAN_ENV)
+        if man_result is not None:
+            if man_result.returncode == 0:
+                logger.info(f"Successfully retrieved man page for {main_command}")
+                man_text = _OVERSTRIKE_RE.sub('', man_result.stdout)
+                return f"Manual page for '{main_command}':\n\n{man_text}"
+            else:
+                logger.warning(f"Man command failed with exit code {man_result.returncode}, stderr: {man_result.stderr}")
 
     # If we tried man first and it failed, try economic approach as fallback
     if not prefer_economic:
         logger.debug(f"Man failed, trying economic approach as fallback for {main_command}")
-        help_result = search_help_documentation(main_command, command_path)
+        help_result = await search_help_documentation(main_command, command_path)
         if help_result:
             return help_result
 
@@ -245,6 +424,62 @@ def get_command_documentation(command: str, prefer_economic: bool = True, man_se
     logger.warning(f"All documentation methods failed for '{command}'")
     return f"No documentation available for '{command}'"
 
+@mcp.tool()
+async def get_command_documentation(command: str, prefer_economic: bool = True, man_section: int = None) -> str:
+    """
+    Get documentation for a command in Unix-like system.
+
+    Args:
+        command: The command to get documentation for (no arguments)
+        prefer_economic: Whether to prefer the economic approach (--help/-h/help) [default: True]
+        man_section: Specific manual section to look in (1-9) [optional]
+
+    Returns:
+        The command documentation as a string
+    """
+    logger.info(f"Getting documentation for command: '{command}', prefer_economic={prefer_economic}, man_section={man_section}")
+
+    # Parse the command input to separate main command from subcommands/arguments
+    parts = command.strip().split()
+    main_command = parts[0]  # Extract the base command
+    logger.debug(f"Main command: {main_command}")
+
+    # Check if there's a subcommand (at least 2 parts and not an option)
+    has_subcommand = len(parts) > 1 and not parts[1].startswith('-')
+    subcommand = parts[1] if has_subcommand else None
+    cmd_with_subcommand = f"{main_command} {subcommand}" if has_subcommand else None
+
+    if has_subcommand:
+        logger.debug(f"Detected subcommand: '{subcommand}', will try '{cmd_with_subcommand}' first")
+
+    # Validate command name (basic check to prevent injection)
+    if not is_valid_command_name(main_command):
+        logger.warning(f"Invalid command name: '{main_command}'")
+        return f"Invalid command name: '{main_command}'"
+
+    cache_key = (" ".join(parts), prefer_economic, man_section)
+    cached = cache_get(_DOC_CACHE, cache_key)
+    if cached is not None:
+        logger.info(f"Returning cached documentation for '{command}'")
+        return cached
+
+    failures = _failure_count
+    result = await find_command_documentation(command, main_command, subcommand, prefer_economic, man_section)
+    # Don't keep a result that a timeout or failed command may have cut short
+    if _failure_count == failures:
+        cache_put(_DOC_CACHE, cache_key, result)
+    return result
+
+def dir_mtimes(directories):
+    """Return a (directory, st_mtime_ns) tuple for each directory, with None for unreadable ones."""
+    mtimes = []
+    for directory in directories:
+        try:
+            mtimes.append((directory, os.stat(directory).st_mtime_ns))
+        except OSError:
+            mtimes.append((directory, None))
+    return tuple(mtimes)
+
 @mcp.tool()
 def list_common_commands() -> str:
     """
@@ -258,46 +493,53 @@ def list_common_commands() -> str:
     common_dirs = ['/bin', '/usr/bin', '/usr/local/bin']
     logger.debug(f"Searching in directories: {common_dirs}")
 
-    commands = []
+    cache_key = dir_mtimes(common_dirs)
+    cached = cache_get(_COMMON_CACHE, cache_key)
+    if cached is not None:
+        logger.debug("Returning cached command list")
+        return cached
+
+    # Directories overlap heavily, so names already found are skipped before any syscall
+    commands: set[str] = set()
     for directory in common_dirs:
         if os.path.exists(directory) and os.path.isdir(directory):
             logger.debug(f"Scanning directory: {directory}")
-            # List only executable files
+            # List only executable files; scandir entries reuse the stat from the directory read
             try:
-                for file in os.listdir(directory):
-                    file_path = os.path.join(directory, file)
-                    if os.path.isfile(file_path) and os.access(file_path, os.X_OK):
-                        commands.append(file)
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.name in commands:
+                            continue
+                        if entry.is_file(follow_symlinks=True) and os.access(entry.path, os.X_OK):
+                            commands.add(entry.name)
             except Exception as e:
                 logger.error(f"Error listing directory {directory}: {str(e)}")
 
-    # Remove duplicates and sort
-    commands = sorted(set(commands))
     logger.info(f"Found {len(commands)} unique commands")
 
     # Return a formatted string with command categories
     result = "Common Unix commands available on this system:\n\n"
 
     # File operations
-    file_cmds = [cmd for cmd in commands if cmd in ['ls', 'cp', 'mv', 'rm', 'mkdir', 'touch', 'chmod', 'chown', 'find', 'grep']]
+    file_cmds = sorted(_FILE_CMDS & commands)
     if file_cmds:
         logger.debug(f"File operation commands found: {len(file_cmds)}")
         result += "File Operations:\n" + ", ".join(file_cmds) + "\n\n"
 
     # Text processing
-    text_cmds = [cmd for cmd in commands if cmd in ['cat', 'less', 'more', 'head', 'tail', 'grep', 'sed', 'awk', 'sort', 'uniq', 'wc']]
+    text_cmds = sorted(_TEXT_CMDS & commands)
     if text_cmds:
         logger.debug(f"Text processing commands found: {len(text_cmds)}")
         result += "Text Processing:\n" + ", ".join(text_cmds) + "\n\n"
 
     # System information
-    sys_cmds = [cmd for cmd in commands if cmd in ['ps', 'top', 'htop', 'df', 'du', 'free', 'uname', 'uptime', 'who', 'whoami']]
+    sys_cmds = sorted(_SYS_CMDS & commands)
     if sys_cmds:
         logger.debug(f"System info commands found: {len(sys_cmds)}")
         result += "System Information:\n" + ", ".join(sys_cmds) + "\n\n"
 
     # Network tools
-    net_cmds = [cmd for cmd in commands if cmd in ['ping', 'netstat', 'ifconfig', 'ip', 'ssh', 'scp', 'curl', 'wget']]
+    net_cmds = sorted(_NET_CMDS & commands)
     if net_cmds:
         logger.debug(f"Networking commands found: {len(net_cmds)}")
         result += "Networking:\n" + ", ".join(net_cmds) + "\n\n"
@@ -306,10 +548,32 @@ def list_common_commands() -> str:
     result += f"Total commands found: {len(commands)}\n"
     result += "Use get_command_documentation() to learn more about any command."
 
+    cache_put(_COMMON_CACHE, cache_key, result, maxsize=1)
     return result
 
+async def describe_command(command_name):
+    """Report where an already validated command lives and its version, if it exists."""
+    command_path = await get_command_path(command_name)
+    if command_path:
+        logger.info(f"Command '{command_name}' exists at {command_path}")
+
+        # Try the version options one at a time (-V is used by some commands); a bare
+        # "version" argument can have side effects (touch version), so it goes last
+        labels = {"--version": "--version", "-V": "-V", "version": "version subcommand"}
+        for option, label in labels.items():
+            logger.debug(f"Trying {label} for {command_name}")
+            version_result = await safe_execute([command_path, option], timeout=5)
+            if version_result and version_result.returncode < 2 and version_result.stdout.strip():
+                logger.debug(f"Got version info using {label} for {command_name}")
+                return f"Command '{command_name}' exists at {command_path}.\nVersion information: {version_result.stdout.strip()}"
+
+        return f"Command '{command_name}' exists on this system at {command_path}."
+    else:
+        logger.warning(f"Command '{command_name}' does not exist or is not in the PATH")
+        return f"Command '{command_name}' does not exist or is not in the PATH."
+
 @mcp.tool()
-def check_command_exists(command: str) -> str:
+async def check_command_exists(command: str) -> str:
     """
     Check if a command exists on the system.
 
@@ -323,39 +587,21 @@ def check_command_exists(command: str) -> str:
     command_name = command.strip().split()[0]
     logger.debug(f"Extracted command name: {command_name}")
 
-    if not re.match(r'^[a-zA-Z0-9_\.-]+$', command_name):
+    if not is_valid_command_name(command_name):
         logger.warning(f"Invalid command name: '{command_name}'")
         return f"Invalid command name: '{command_name}'"
 
-    command_path = get_command_path(command_name)
-    if command_path:
-        logger.info(f"Command '{command_name}' exists at {command_path}")
-
-        # Try --version
-        logger.debug(f"Trying --version for {command_name}")
-        version_result = safe_execute([command_path, "--version"], timeout=5)
-        if version_result and version_result.returncode < 2 and version_result.stdout.strip():
-            logger.debug(f"Got version info using --version for {command_name}")
-            return f"Command '{command_name}' exists at {command_path}.\nVersion information: {version_result.stdout.strip()}"
-
-        # Try -V (some commands use this for version)
-        logger.debug(f"Trying -V for {command_name}")
-        version_result = safe_execute([command_path, "-V"], timeout=5)
-        if version_result and version_result.returncode < 2 and version_result.stdout.strip():
-            logger.debug(f"Got version info using -V for {command_name}")
-            return f"Command '{command_name}' exists at {command_path}.\nVersion information: {version_result.stdout.strip()}"
-
-        # Try version
-        logger.debug(f"Trying version subcommand for {command_name}")
-        version_result = safe_execute([command_path, "version"], timeout=5)
-        if version_result and version_result.returncode < 2 and version_result.stdout.strip():
-            logger.debug(f"Got version info using version subcommand for {command_name}")
-            return f"Command '{command_name}' exists at {command_path}.\nVersion information: {version_result.stdout.strip()}"
+    cached = cache_get(_EXISTS_CACHE, command_name)
+    if cached is not None:
+        logger.info(f"Returning cached result for '{command_name}'")
+        return cached
 
-        return f"Command '{command_name}' exists on this system at {command_path}."
-    else:
-        logger.warning(f"Command '{command_name}' does not exist or is not in the PATH")
-        return f"Command '{command_name}' does not exist or is not in the PATH."
+    failures = _failure_count
+    result = await describe_command(command_name)
+    # Don't keep a result that a timeout or failed command may have cut short
+    if _failure_count == failures:
+        cache_put(_EXISTS_CACHE, command_name, result)
+    return result
 
 def main():
     logger.info("Starting unix-manual-server")